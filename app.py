@@ -3,17 +3,24 @@
 # and connects the frontend to the backend logic.
 
 import os
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+import logging
+import functools
+import click
+import orjson
+from flask import Flask, request, jsonify, render_template, redirect, url_for, g, session, stream_with_context
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
-from models import db, User
+from models import db, User, SessionUser
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from flask_compress import Compress
 from cryptography.fernet import Fernet
 # existing imports...
 from main_logic import (
     run_full_analysis,
-    generate_groq_recommendations,
+    run_streaming_analysis,
     get_threads_profile,
     fetch_user_threads,
+    fetch_threads_with_replies,
     fetch_replies,
     analyze_replies_sentiment
 )
@@ -21,28 +28,78 @@ from main_logic import (
 # Load environment variables from .env file for local development
 load_dotenv()
 
+# INFO by default, so the backend's debug lines cost nothing in production (LOG_LEVEL=DEBUG to see them)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+class OrjsonProvider(JSONProvider):
+    """Serializes jsonify() responses with orjson, which is several times faster than the stdlib json."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round-trip in dumps()
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype='application/json')
+
 # Initialize the main Flask application
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # --- App Configuration ---
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# --- Initialize Extensions (Database & Login Manager) ---
+# Compress JSON/HTML responses (Brotli when the browser supports it, else gzip)
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html']
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_MIN_SIZE'] = 500
+# Upper bound on posts per /api/fetch_threads call with include_replies (each post fans out into a replies request)
+MAX_THREADS_LIMIT = 25
+
+# --- Initialize Extensions (Database, Login Manager & Compression) ---
 db.init_app(app)
+Compress(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    """This function is used by Flask-Login to load the current user from the database."""
-    return User.query.get(int(user_id))
+    """
+    This function is used by Flask-Login to load the current user from the database.
+    Flask-Login already keeps the result for the rest of the request, so this runs once per request.
+    Once the (id, username) pair is cached in the signed session, page routes get a SessionUser
+    instead and skip the SELECT. API routes always load the row, so a deleted account is anonymous there.
+    """
+    uid = int(user_id)
+    identity = session.get('_user_identity')
+    if identity and identity[0] == uid and not request.path.startswith('/api/'):
+        return SessionUser(uid, identity[1])
+
+    user = db.session.get(User, uid)
+    if user:
+        # Only write when it changed: any write re-sends the whole session cookie, and a late
+        # response carrying the old session would undo a logout made in the meantime
+        if identity != [user.id, user.username]:
+            session['_user_identity'] = [user.id, user.username]
+    else:
+        # Row is gone: forget the cached identity so page routes stop trusting it too
+        session.pop('_user_identity', None)
+    return user
 
 # --- Security Functions for Token Encryption ---
+@functools.lru_cache(maxsize=1)
 def get_cipher():
-    """Gets the encryption cipher using the key from the environment."""
+    """
+    Gets the encryption cipher using the key from the environment.
+    The cipher is built once and reused, since the key never changes while the app runs.
+    """
     key_string = os.environ.get('ENCRYPTION_KEY')
     if not key_string:
         raise ValueError("ENCRYPTION_KEY is not set in the environment!")
@@ -58,11 +115,29 @@ def encrypt_token(token):
     return cipher.encrypt(token.encode('utf-8')).decode('utf-8')
 
 def decrypt_token(encrypted_token):
-    """Decrypts a token."""
+    """Decrypts a token. Fernet accepts the stored base64 string as-is, so no re-encoding is needed."""
     if not encrypted_token:
         return None
     cipher = get_cipher()
-    return cipher.decrypt(encrypted_token.encode('utf-8')).decode('utf-8')
+    return cipher.decrypt(encrypted_token).decode('utf-8')
+
+def decrypt_tokens_batch(encrypted_tokens):
+    """Decrypts a list of tokens with a single cipher instance (for bulk/back-end jobs)."""
+    cipher = get_cipher()
+    return [cipher.decrypt(t).decode('utf-8') if t else None for t in encrypted_tokens]
+
+def get_threads_token():
+    """
+    Returns the current user's decrypted Threads token, decrypting at most once per request.
+    The cached value is tied to the encrypted field, so saving a new token invalidates it.
+    """
+    encrypted = current_user.encrypted_threads_token
+    # Membership check, not g.get(): a user without a saved token has encrypted=None,
+    # which would otherwise look like an already-cached value
+    if '_threads_token_src' not in g or g._threads_token_src is not encrypted:
+        g.threads_token = decrypt_token(encrypted)
+        g._threads_token_src = encrypted
+    return g.threads_token
 
 # ==============================================================================
 # SECTION 1: HTML SERVING ROUTES (The Pages Users See)
@@ -118,12 +193,14 @@ def threads_page():
 def api_register():
     """Handles the registration form submission."""
     data = request.get_json()
-    username = data.get('username')
+    username = User.normalize_username(data.get('username'))
     password = data.get('password')
 
     if not username or not password:
         return jsonify({"error": "Username and password are required."}), 400
 
+    # Plain equality on the normalised name, so the unique index serves it
+    # (legacy mixed-case rows are lowercased by `flask normalize-usernames`)
     if User.query.filter_by(username=username).first():
         return jsonify({"error": "Username already taken."}), 409
 
@@ -137,12 +214,21 @@ def api_register():
 def api_login():
     """Handles the login form submission."""
     data = request.get_json()
-    username = data.get('username')
+    raw_username = (data.get('username') or '').strip()
+    username = User.normalize_username(raw_username)
     password = data.get('password')
     user = User.query.filter_by(username=username).first()
+    authenticated = user is not None and user.check_password(password)
 
-    if user and user.check_password(password):
+    if not authenticated and raw_username != username:
+        # Accounts created before usernames were normalised (and ones normalize-usernames
+        # skipped on a collision) keep their original spelling, so try that exact name too
+        user = User.query.filter_by(username=raw_username).first()
+        authenticated = user is not None and user.check_password(password)
+
+    if authenticated:
         login_user(user, remember=True)
+        session['_user_identity'] = [user.id, user.username]
         return jsonify({"message": "Logged in successfully."}), 200
     
     return jsonify({"error": "Invalid username or password."}), 401
@@ -152,6 +238,7 @@ def api_login():
 def api_logout():
     """Logs the current user out."""
     logout_user()
+    session.pop('_user_identity', None)
     return jsonify({"message": "Logged out successfully."}), 200
 
 @app.route('/api/update_token', methods=['POST'])
@@ -168,7 +255,7 @@ def api_update_token():
         db.session.commit()
         return jsonify({"message": "Token updated successfully."}), 200
     except Exception as e:
-        print(f"ERROR in api_update_token: {e}") 
+        app.logger.error("ERROR in api_update_token: %s", e)
         return jsonify({"error": "An internal error occurred while saving the token."}), 500
 
 @app.route('/api/analyze', methods=['POST'])
@@ -179,19 +266,48 @@ def api_analyze():
     if not keyword:
         return jsonify({"error": "Keyword is required"}), 400
 
-    user_threads_token = decrypt_token(current_user.encrypted_threads_token)
+    user_threads_token = get_threads_token()
     if not user_threads_token:
         return jsonify({"error": "Please add your Threads Access Token in the Account page first."}), 400
 
-    analysis_data = run_full_analysis(user_threads_token, keyword)
+    # The Groq recommendation runs alongside the tail of the SerpApi fan-out
+    analysis_data = run_full_analysis(user_threads_token, keyword, with_recommendation=True)
     if "error" in analysis_data:
         return jsonify(analysis_data), 500
 
-    ai_recommendation = generate_groq_recommendations(analysis_data, keyword)
-    analysis_data['ai_recommendation'] = ai_recommendation
-    
     return jsonify(analysis_data)
 
+@app.route('/api/analyze/stream', methods=['POST'])
+@login_required
+def api_analyze_stream():
+    """
+    Streaming version of /api/analyze, sent as newline-delimited JSON:
+    first the analysis data, then the AI recommendation in chunks as Groq generates it.
+    """
+    keyword = request.json.get('keyword')
+    if not keyword:
+        return jsonify({"error": "Keyword is required"}), 400
+
+    user_threads_token = get_threads_token()
+    if not user_threads_token:
+        return jsonify({"error": "Please add your Threads Access Token in the Account page first."}), 400
+
+    # The Groq stream is opened as soon as topics/queries/news are in, overlapping the forecast worker
+    analysis_data, deltas = run_streaming_analysis(user_threads_token, keyword)
+    if "error" in analysis_data:
+        return jsonify(analysis_data), 500
+
+    def generate():
+        yield app.json.dumps({"type": "analysis", "data": analysis_data}) + "\n"
+        for delta in deltas:
+            yield app.json.dumps({"type": "recommendation", "delta": delta}) + "\n"
+        yield app.json.dumps({"type": "done"}) + "\n"
+
+    # application/x-ndjson is not in COMPRESS_MIMETYPES, so chunks are flushed as they come
+    # (X-Accel-Buffering stops a fronting nginx from holding them back too)
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson',
+                              headers={'X-Accel-Buffering': 'no'})
+
 
 # ----- NEW THREADS ANALYSIS API ENDPOINTS -----
 
@@ -202,7 +318,7 @@ def api_account_info():
     if not current_user.encrypted_threads_token:
         return jsonify({"has_token": False, "message": "No token saved."}), 200
     try:
-        token = decrypt_token(current_user.encrypted_threads_token)
+        token = get_threads_token()
         profile = get_threads_profile(token)
         return jsonify({"has_token": True, "profile": profile})
     except Exception as e:
@@ -217,15 +333,21 @@ def api_fetch_threads():
     limit = int(data.get("limit", 3))
     since = data.get("since") or None
     until = data.get("until", "now")
+    include_replies = bool(data.get("include_replies", False))
 
     if not current_user.encrypted_threads_token:
         return jsonify({"error": "Please add your Threads Access Token in the Account page first."}), 400
     try:
-        token = decrypt_token(current_user.encrypted_threads_token)
-        threads_json = fetch_user_threads(token, limit=limit, since=since, until=until)
+        token = get_threads_token()
+        if include_replies:
+            # Replies for every post are fetched concurrently in one go, so the fan-out is bounded
+            limit = max(1, min(limit, MAX_THREADS_LIMIT))
+            threads_json = fetch_threads_with_replies(token, limit=limit, since=since, until=until)
+        else:
+            threads_json = fetch_user_threads(token, limit=limit, since=since, until=until)
         return jsonify(threads_json)
     except Exception as e:
-        print(f"ERROR in api_fetch_threads: {e}")
+        app.logger.error("ERROR in api_fetch_threads: %s", e)
         return jsonify({"error": "An internal error occurred while fetching threads."}), 500
 
 
@@ -240,7 +362,7 @@ def api_analyze_post():
     if not current_user.encrypted_threads_token:
         return jsonify({"error": "Please add your Threads Access Token in the Account page first."}), 400
     try:
-        token = decrypt_token(current_user.encrypted_threads_token)
+        token = get_threads_token()
         replies_json = fetch_replies(token, post_id)
         if "error" in replies_json:
             return jsonify(replies_json), 500
@@ -248,9 +370,38 @@ def api_analyze_post():
         analysis = analyze_replies_sentiment(replies_list)
         return jsonify({"replies": replies_list, "analysis": analysis})
     except Exception as e:
-        print(f"ERROR in api_analyze_post: {e}")
+        app.logger.error("ERROR in api_analyze_post: %s", e)
         return jsonify({"error": "An internal error occurred during sentiment analysis."}), 500
 
+
+# ==============================================================================
+# SECTION 3: CLI COMMANDS
+# ==============================================================================
+
+@app.cli.command('normalize-usernames')
+def normalize_usernames():
+    """
+    One-off migration: lowercases usernames created before they were normalised.
+    Rows whose lowercase form is already taken are left as-is and reported; they can still
+    log in with their exact original username (see api_login).
+    """
+    users = User.query.all()
+    taken = {user.username for user in users}
+    changed = 0
+    for user in users:
+        normalized = User.normalize_username(user.username)
+        if normalized == user.username:
+            continue
+        if normalized in taken:
+            click.echo(f"Skipped {user.username!r}: {normalized!r} is already taken.")
+            continue
+        taken.discard(user.username)
+        taken.add(normalized)
+        user.username = normalized
+        changed += 1
+    db.session.commit()
+    click.echo(f"Normalized {changed} username(s).")
+
 # This block allows you to run the app directly using 'python app.py'
 if __name__ == '__main__':
     # Creates the database tables from your models if they don't exist yet
@@ -2,78 +2,202 @@
 # This file contains the core data-gathering and analysis functions for the application.
 
 import os
-import json
+import re
+import logging
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import itertools
 import time
-from datetime import datetime
-from collections import Counter
+import functools
+import hashlib
+import threading
+import statistics
+from cachetools import TTLCache
 from groq import Groq
-import concurrent.futures 
+import concurrent.futures
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
+logger = logging.getLogger(__name__)
+
 # ==============================================================================
 # SECTION 1: SERPAPI SETUP AND HELPERS
 # ==============================================================================
 
+_SERVICE_KEY_ENV_VARS = {
+    "forecast": "SERP_API_KEY_FORECAST",
+    "topics": "SERP_API_KEY_TOPICS",
+    "queries": "SERP_API_KEY_QUERIES",
+    "news": "SERP_API_KEY_NEWS"
+}
+
+@functools.lru_cache(maxsize=8)
+def _dedicated_key(service_name):
+    # Environment lookups are static for the life of the process, so they are cached.
+    # Only called at request time, after app.py has loaded .env.
+    env_var = _SERVICE_KEY_ENV_VARS.get(service_name)
+    return os.environ.get(env_var) if env_var else None
+
 def get_key_for_service(service_name):
     """
     Retrieves the dedicated key for a specific service (forecast, topics, queries, news).
     Falls back to the main rotation if the specific key is missing.
     """
-    env_var_map = {
-        "forecast": "SERP_API_KEY_FORECAST",
-        "topics": "SERP_API_KEY_TOPICS",
-        "queries": "SERP_API_KEY_QUERIES",
-        "news": "SERP_API_KEY_NEWS"
-    }
-    
-    specific_key = os.environ.get(env_var_map.get(service_name))
+    specific_key = _dedicated_key(service_name)
     if specific_key:
         return specific_key
     
     # Fallback to main rotation
-    if _key_cycle:
-        return next(_key_cycle)
-    
-    return None
+    return next_rotation_key()
 
 # Initialize main fallback keys
 try:
     keys_str = os.environ.get('SERP_API_KEYS')
     SERP_KEYS = [k.strip() for k in keys_str.split(',')] if keys_str else []
-    _key_cycle = itertools.cycle(SERP_KEYS) if SERP_KEYS else None
 except Exception:
     SERP_KEYS = []
-    _key_cycle = None
 
-def serp_get(params, api_key=None, timeout=120):
+# next() on itertools.count is atomic in CPython, so the parallel workers never
+# grab the same rotation slot (unlike sharing an itertools.cycle across threads)
+_key_counter = itertools.count()
+
+def next_rotation_key():
+    """Returns the next key from the main SERP_API_KEYS rotation, or None if there are none."""
+    if not SERP_KEYS:
+        return None
+    return SERP_KEYS[next(_key_counter) % len(SERP_KEYS)]
+
+# Shared HTTP session so SerpApi and Threads calls reuse pooled keep-alive connections
+# instead of paying a fresh TCP + TLS handshake on every request. Transient failures are
+# retried by the adapter with exponential backoff.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=4,
+        read=1,  # a read timeout is retried once, not four times
+        backoff_factor=0.5,
+        backoff_jitter=0.25,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,  # honour SerpApi's Retry-After on 429s
+    )
+))
+# Per-attempt (connect, read) timeouts for SerpApi. With the retry policy above one call is
+# bounded to ~35s, so even the forecast worker's variant fallbacks fit inside ANALYSIS_TIMEOUT
+# and a worker abandoned at the deadline frees its pool thread soon after.
+SERP_TIMEOUT = (3.05, 15)
+# Graph API calls get their own connection pool (so a busy SerpApi fan-out can't starve them)
+# and a retry policy without 500s, which the Threads API uses for real request errors.
+# Connect/read retries are bounded separately so a dead host can't eat the whole retry budget.
+# requests picks the longest matching prefix, so this overrides the generic https:// adapter.
+_session.mount("https://graph.threads.net/", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=3,
+        connect=2,
+        read=2,
+        backoff_factor=0.4,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+))
+# (connect, read) timeouts for Graph calls: fail fast on a stuck handshake, allow a slower body
+GRAPH_TIMEOUT = (3.05, 10)
+# Overall time budget (seconds) for a multi-call Graph fetch such as posts + all their replies
+GRAPH_DEADLINE = 25
+
+def ttl_cache(ttl, key, maxsize=1024, stale_ttl=None):
+    """
+    Caches a function's results in memory for `ttl` seconds, keyed by key(*args, **kwargs).
+    Error responses ({"error": ...}) are never cached, so failures are retried next time.
+    With stale_ttl (> ttl), an expired entry younger than stale_ttl is still returned right away
+    while a background thread refreshes it (stale-while-revalidate).
+    """
+    def decorator(func):
+        cache = TTLCache(maxsize=maxsize, ttl=stale_ttl or ttl)
+        lock = threading.Lock()
+        refreshing = set()
+
+        def load(cache_key, args, kwargs):
+            result = func(*args, **kwargs)
+            if not (isinstance(result, dict) and "error" in result):
+                with lock:
+                    cache[cache_key] = (result, time.monotonic())
+            return result
+
+        def refresh(cache_key, args, kwargs):
+            try:
+                load(cache_key, args, kwargs)
+            finally:
+                with lock:
+                    refreshing.discard(cache_key)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            with lock:
+                entry = cache.get(cache_key)
+                if entry is not None:
+                    result, fetched_at = entry
+                    if time.monotonic() - fetched_at < ttl:
+                        return result
+                    if stale_ttl:
+                        # Serve the stale value; only one refresh per key runs at a time
+                        if cache_key not in refreshing:
+                            refreshing.add(cache_key)
+                            threading.Thread(target=refresh, args=(cache_key, args, kwargs), daemon=True).start()
+                        return result
+            return load(cache_key, args, kwargs)
+        return wrapper
+    return decorator
+
+# Cache keys deliberately leave out the API key: the data doesn't depend on which key fetched it.
+def _trends_cache_key(keyword, api_key, geo="", date="today 12-m"):
+    return (keyword, geo, date)
+
+def _news_cache_key(keyword, api_key, hl="en", gl="us"):
+    return (keyword, hl, gl)
+
+def _token_hash(access_token):
+    # Hash the token so raw access tokens are never held as cache keys
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+
+def _token_cache_key(access_token):
+    return _token_hash(access_token)
+
+def _user_threads_cache_key(access_token, limit=3, since=None, until="now"):
+    return (_token_hash(access_token), limit, since, until)
+
+def serp_get(params, api_key=None, timeout=SERP_TIMEOUT):
     """
     Makes a GET request to SerpApi using a specific key.
     """
     if not api_key:
-        if _key_cycle:
-            api_key = next(_key_cycle)
-        else:
-            print("Error: No SerpApi key available for this request.")
+        api_key = next_rotation_key()
+        if not api_key:
+            logger.error("No SerpApi key available for this request.")
             return {"error": "No API key"}
 
     params_with_key = dict(params)
     params_with_key["api_key"] = api_key
     
     try:
-        # We use a dedicated key, so we can retry a few times on that same key if needed
-        for attempt in range(3):
-            try:
-                r = requests.get("https://serpapi.com/search.json", params=params_with_key, timeout=timeout)
-                if r.status_code == 200:
-                    return r.json()
-                else:
-                    print(f"SerpApi Attempt {attempt+1} failed: {r.status_code}")
-                    time.sleep(1)
-            except requests.RequestException:
-                time.sleep(1)
-                continue
+        # Retries (on the same dedicated key) are handled by the session's adapter.
+        # stream=True: the body is read once straight off the socket (no extra buffered copy),
+        # and failed responses are closed without downloading their body at all
+        with _session.get("https://serpapi.com/search.json", params=params_with_key, stream=True, timeout=timeout) as r:
+            if r.status_code == 200:
+                # orjson parses the raw bytes directly (no text decode) and is much faster than r.json()
+                return orjson.loads(r.raw.read(decode_content=True))
+            # Only the first 300 bytes of the error body are read and decoded
+            snippet = r.raw.read(300, decode_content=True).decode('utf-8', 'replace')
+            logger.warning("SerpApi request failed: %s %s", r.status_code, snippet)
+            return {"error": f"SerpApi returned {r.status_code}"}
+    except requests.RequestException:
         return {"error": "Request failed after retries"}
     except Exception as e:
         return {"error": str(e)}
@@ -82,39 +206,64 @@ def serp_get(params, api_key=None, timeout=120):
 # SECTION 2: GOOGLE TRENDS AND NEWS WRAPPERS
 # ==============================================================================
 
+_SIMPLIFIERS = frozenset({'best', 'top', 'latest', 'new', 'good', 'great', 'cheap', 'affordable', 'premium'})
+
+@functools.lru_cache(maxsize=1024)
 def process_keyword_for_trends(keyword):
-    simplifiers = ['best', 'top', 'latest', 'new', 'good', 'great', 'cheap', 'affordable', 'premium']
+    # Cached per keyword; callers must treat the returned dict as read-only
     words = keyword.lower().split()
     words = [w for w in words if not (w.isdigit() and len(w) == 4)]
-    core_words = [w for w in words if w not in simplifiers]
+    core_words = [w for w in words if w not in _SIMPLIFIERS]
     if not core_words: core_words = words
     simplified = ' '.join(core_words)
     very_simple = ' '.join(core_words[:2])
     return {'original': keyword, 'simplified': simplified, 'core': very_simple}
 
 # --- API CALL FUNCTIONS (Now accept an explicit API key) ---
+# Repeat keywords are served from cache: Trends data for 10 minutes, news (which moves faster) for 2.
+
+@ttl_cache(ttl=600, key=_trends_cache_key)
+def _fetch_interest_over_time_variant(query, api_key, geo="", date="today 12-m"):
+    """
+    One TIMESERIES lookup, cached per exact query string. A variant that SerpApi answered
+    with no timeline is cached too (as {"no_data": True}), so fallbacks don't re-spend calls on it.
+    """
+    params = {"engine": "google_trends", "q": query, "data_type": "TIMESERIES", "geo": geo, "date": date}
+    result = serp_get(params, api_key=api_key)
+    if "interest_over_time" in result:
+        return result
+    if "search_metadata" in result:
+        # A real SerpApi answer (just without data), not a transport failure
+        return {"no_data": True}
+    return result
 
 def fetch_interest_over_time_raw(keyword, api_key, geo="", date="today 12-m"):
     processed = process_keyword_for_trends(keyword)
-    # Try variations if original fails, but keep it simple for this worker
+    # Try variations if original fails. Each variant is cached on its own, so repeat analyses and
+    # keywords that simplify to the same variant ("best laptops", "top laptops") share lookups.
     unique_versions = list(dict.fromkeys([processed['original'], processed['simplified'], processed['core']]))
-    
+
     for version in unique_versions:
-        params = {"engine": "google_trends", "q": version, "data_type": "TIMESERIES", "geo": geo, "date": date}
-        result = serp_get(params, api_key=api_key)
-        if "error" not in result and "interest_over_time" in result:
+        result = _fetch_interest_over_time_variant(version, api_key, geo, date)
+        if "error" in result:
+            # Transport/API failure, not an empty answer: the other variants would fail the same way
+            break
+        if "interest_over_time" in result:
             return result
-            
+
     return {"error": "Could not fetch interest over time"}
 
+@ttl_cache(ttl=600, key=_trends_cache_key)
 def fetch_related_topics_raw(keyword, api_key, geo="", date="today 12-m"):
     params = {"engine": "google_trends", "q": keyword, "data_type": "RELATED_TOPICS", "geo": geo, "date": date}
     return serp_get(params, api_key=api_key)
 
+@ttl_cache(ttl=600, key=_trends_cache_key)
 def fetch_related_queries_raw(keyword, api_key, geo="", date="today 12-m"):
     params = {"engine": "google_trends", "q": keyword, "data_type": "RELATED_QUERIES", "geo": geo, "date": date}
     return serp_get(params, api_key=api_key)
 
+@ttl_cache(ttl=120, key=_news_cache_key)
 def fetch_top_news_raw(keyword, api_key, hl="en", gl="us"):
     params = {"engine": "google_news", "q": keyword, "hl": hl, "gl": gl}
     return serp_get(params, api_key=api_key)
@@ -124,20 +273,14 @@ def fetch_top_news_raw(keyword, api_key, hl="en", gl="us"):
 # ==============================================================================
 
 def parse_interest_over_time(results_json, keyword):
-    out = {}
-    if not results_json or "error" in results_json: return out
-    iot = results_json.get("interest_over_time", {})
-    timeline = iot.get("timeline_data", [])
-    for item in timeline:
-        date = item.get("date", "")
-        values = item.get("values", [])
-        if not date or not values: continue
-        for value_item in values:
-            # Just grab the extracted value
-            val = value_item.get("extracted_value", 0)
-            if keyword not in out: out[keyword] = []
-            out[keyword].append((date, val))
-    return out
+    if not results_json or "error" in results_json: return {}
+    timeline = results_json.get("interest_over_time", {}).get("timeline_data", [])
+    # Parallel date/value lists instead of a (date, value) tuple per point; points without a date are skipped
+    dated = [item for item in timeline if item.get("date")]
+    values = [value_item.get("extracted_value", 0) for item in dated for value_item in item.get("values") or ()]
+    if not values: return {}
+    dates = [item["date"] for item in dated for _ in item.get("values") or ()]
+    return {keyword: (dates, values)}
 
 # def parse_related_topics(results_json):
 #     if not results_json or "related_topics" not in results_json: return []
@@ -200,16 +343,10 @@ def parse_related_queries(results_json):
     top = results_json["related_queries"].get("top", [])
     rising = results_json["related_queries"].get("rising", [])
     
-    # Ensure they have the right keys for frontend
-    cleaned = []
-    for item in top + rising:
-        if "query" in item:
-            cleaned.append({
-                "query": item["query"],
-                "rising": item.get("rising", False) # Preserve rising flag if present
-            })
-            
-    return cleaned
+    # Ensure they have the right keys for frontend. The rising flag comes from which
+    # list the item is in (SerpApi doesn't set it), and the API objects are left untouched.
+    return [{"query": item["query"], "rising": False} for item in top if "query" in item] + \
+           [{"query": item["query"], "rising": True} for item in rising if "query" in item]
 
 def parse_news_results(results_json):
     if not results_json: return []
@@ -228,60 +365,128 @@ def parse_news_results(results_json):
         })
     return clean_news
 
-def try_forecast(timeseries_list):
-    if not timeseries_list or len(timeseries_list) < 2:
+def try_forecast(values):
+    """Classifies the trend of a list of interest values (oldest first)."""
+    if not values or len(values) < 2:
         return {"trend": "unknown", "reason": "insufficient data"}
-    first_val = timeseries_list[0][1]
-    last_val = timeseries_list[-1][1]
-    if last_val > first_val * 1.15: trend = "rising"
-    elif last_val < first_val * 0.85: trend = "falling"
+    first_val = values[0]
+    last_val = values[-1]
+
+    # Least-squares slope over x = 0..n-1 (whose variance sum is n(n^2-1)/12), so every point
+    # counts and a noisy first or last week can't flip the result.
+    n = len(values)
+    mean = statistics.fmean(values)
+    x_mean = (n - 1) / 2
+    slope = sum((i - x_mean) * (v - mean) for i, v in enumerate(values)) / (n * (n * n - 1) / 12)
+    pct_change = (last_val - first_val) / first_val * 100 if first_val else None
+
+    # Change implied by the fitted line across the whole window, relative to the average level
+    norm = slope * n / max(mean, 1e-6)
+    if norm > 0.15: trend = "rising"
+    elif norm < -0.15: trend = "falling"
     else: trend = "flat"
-    return {"trend": trend, "reason": f"simple_delta: from {first_val} to {last_val}"}
+
+    return {
+        "trend": trend,
+        "reason": f"linear_fit: {norm:+.0%} over {n} points (from {first_val} to {last_val})",
+        "slope": round(slope, 4),
+        "mean": round(mean, 2),
+        "std": round(statistics.pstdev(values), 2),
+        "pct_change": round(pct_change, 1) if pct_change is not None else None
+    }
 
 # ==============================================================================
 # SECTION 4: AI RECOMMENDATION ENGINE
 # ==============================================================================
 
-def generate_groq_recommendations(analysis_data, keyword):
-    try:
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-    except Exception as e:
-        return f"Groq API key not configured. Error: {e}"
+_groq_client = None
+_groq_client_lock = threading.Lock()
 
-    prompt_data = f"Keyword: {keyword}\n"
-    prompt_data += f"Trend Analysis: {analysis_data.get('trend_data', {}).get('trend', 'unknown')}\n\n"
-    
-    # Extract titles for prompt
-    topics_str = "\n".join([f"- {t.get('title', '')}" for t in analysis_data.get('related_topics', [])[:5]])
-    prompt_data += f"Related Topics:\n{topics_str}\n\n"
-    
-    queries_str = "\n".join([f"- {q.get('query', '')} {'(Rising)' if q.get('rising') else ''}" for q in analysis_data.get('related_queries', [])[:5]])
-    prompt_data += f"Related Queries:\n{queries_str}\n\n"
-    
-    news_str = "\n".join([f"- {n.get('title', '')}" for n in analysis_data.get('news_items', [])[:3]])
-    prompt_data += f"Recent News:\n{news_str}"
-
-    system_prompt = "You are a world-class content strategist. Use Markdown."
-    user_prompt = f"""
-    Based on the following data, create a comprehensive content strategy. Include:
-    1. Overall Summary
-    2. Three specific Content Ideas
-    3. Suggested Hashtags
-    4. Quick Start Action Plan (3 steps)
-    ---
-    DATA:
-    {prompt_data}
-    ---
+def get_groq_client():
     """
+    Returns a shared Groq client so its connection pool (and TLS session) is reused across requests,
+    or None if GROQ_API_KEY is not set.
+    Built on first use rather than at import, because app.py loads .env after importing this module.
+    """
+    global _groq_client
+    if _groq_client is None:
+        api_key = os.environ.get("GROQ_API_KEY")
+        if not api_key:
+            return None
+        with _groq_client_lock:
+            if _groq_client is None:
+                _groq_client = Groq(api_key=api_key)
+    return _groq_client
+
+# Static prompt text is built once at import; only the DATA block changes per request
+_SYSTEM_PROMPT = "You are a world-class content strategist. Use Markdown."
+_USER_PROMPT_TEMPLATE = (
+    "Based on the following data, create a comprehensive content strategy. Include:\n"
+    "1. Overall Summary\n"
+    "2. Three specific Content Ideas\n"
+    "3. Suggested Hashtags\n"
+    "4. Quick Start Action Plan (3 steps)\n"
+    "---\n"
+    "DATA:\n"
+    "{data}\n"
+    "---\n"
+)
+
+def _build_recommendation_messages(analysis_data, keyword):
+    # Build the prompt in one join; each section's lines come from a generator (no temp lists)
+    prompt_data = "\n".join([
+        f"Keyword: {keyword}",
+        f"Trend Analysis: {analysis_data.get('trend_data', {}).get('trend', 'unknown')}",
+        "",
+        "Related Topics:",
+        "\n".join(f"- {t.get('title', '')}" for t in analysis_data.get('related_topics', [])[:5]),
+        "",
+        "Related Queries:",
+        "\n".join(f"- {q.get('query', '')} {'(Rising)' if q.get('rising') else ''}" for q in analysis_data.get('related_queries', [])[:5]),
+        "",
+        "Recent News:",
+        "\n".join(f"- {n.get('title', '')}" for n in analysis_data.get('news_items', [])[:3]),
+    ])
+    user_prompt = _USER_PROMPT_TEMPLATE.format(data=prompt_data)
+    return [{'role': 'system', 'content': _SYSTEM_PROMPT}, {'role': 'user', 'content': user_prompt}]
+
+def generate_groq_recommendations(analysis_data, keyword):
+    client = get_groq_client()
+    if client is None:
+        return "Groq API key not configured."
+
     try:
         chat_completion = client.chat.completions.create(
-            messages=[{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': user_prompt}],
+            messages=_build_recommendation_messages(analysis_data, keyword),
             model="llama-3.3-70b-versatile",
         )
         return chat_completion.choices[0].message.content
     except Exception as e:
         return f"An error occurred while calling the Groq API: {e}"
 
+def stream_groq_recommendations(analysis_data, keyword):
+    """
+    Same as generate_groq_recommendations, but yields the Markdown in chunks as Groq generates it,
+    so the first words reach the user after ~one token of latency instead of the full generation.
+    """
+    client = get_groq_client()
+    if client is None:
+        yield "Groq API key not configured."
+        return
+
+    try:
+        stream = client.chat.completions.create(
+            messages=_build_recommendation_messages(analysis_data, keyword),
+            model="llama-3.3-70b-versatile",
+            stream=True,
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+    except Exception as e:
+        yield f"\n\nAn error occurred while calling the Groq API: {e}"
+
 # ==============================================================================
 # SECTION 5: MASTER ANALYSIS FUNCTION (4-WORKER PARALLEL EXECUTION)
 # ==============================================================================
@@ -292,10 +497,10 @@ def worker_forecast(keyword):
         raw = fetch_interest_over_time_raw(keyword, key)
         parsed = parse_interest_over_time(raw, keyword)
         # Get the first available timeseries
-        series = next(iter(parsed.values()), [])
-        return try_forecast(series)
+        _dates, values = next(iter(parsed.values()), ([], []))
+        return try_forecast(values)
     except Exception as e:
-        print(f"Forecast Worker Failed: {e}")
+        logger.error("Forecast Worker Failed: %s", e)
         return {"trend": "unknown", "reason": "error"}
 
 def worker_topics(keyword):
@@ -304,7 +509,7 @@ def worker_topics(keyword):
         raw = fetch_related_topics_raw(keyword, key)
         return parse_related_topics(raw)
     except Exception as e:
-        print(f"Topics Worker Failed: {e}")
+        logger.error("Topics Worker Failed: %s", e)
         return []
 
 # def worker_queries(keyword):
@@ -318,19 +523,19 @@ def worker_topics(keyword):
     
 def worker_queries(keyword):
     key = get_key_for_service("queries")
-    print(f"🔍 DEBUG: Fetching Queries for '{keyword}' using key ...{str(key)[-5:]}")
+    logger.debug("Fetching Queries for %r using key ...%s", keyword, str(key)[-5:])
     
     try:
         raw = fetch_related_queries_raw(keyword, key)
         
         # --- NEW DEBUGGING BLOCK ---
         if isinstance(raw, dict) and "error" in raw:
-            print(f"❌ API ERROR (Queries): {raw['error']}")
+            logger.error("API ERROR (Queries): %s", raw['error'])
             return []
             
         if isinstance(raw, dict) and "related_queries" not in raw:
-            print(f"⚠️ MISSING DATA (Queries): API returned valid JSON but no 'related_queries'.")
-            print(f"   Available keys: {list(raw.keys())}")
+            logger.warning("MISSING DATA (Queries): API returned valid JSON but no 'related_queries'. "
+                           "Available keys: %s", list(raw.keys()))
             # If Google Trends is just empty, this is normal.
             return []
         # ---------------------------
@@ -338,7 +543,7 @@ def worker_queries(keyword):
         return parse_related_queries(raw)
         
     except Exception as e:
-        print(f"❌ CRITICAL ERROR in Queries Worker: {e}")
+        logger.error("CRITICAL ERROR in Queries Worker: %s", e)
         return []
 
 def worker_news(keyword):
@@ -347,83 +552,190 @@ def worker_news(keyword):
         raw = fetch_top_news_raw(keyword, key)
         return parse_news_results(raw)
     except Exception as e:
-        print(f"News Worker Failed: {e}")
+        logger.error("News Worker Failed: %s", e)
         return []
 
-def run_full_analysis(user_threads_token, keyword):
+# One long-lived pool shared by every analysis, so a request doesn't spawn and tear down
+# its own threads. Each analysis uses 5 slots (4 SerpApi workers + Groq), so this fits
+# 5 concurrent analyses per process.
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=25, thread_name_prefix="analysis")
+# Threads API fan-outs get their own small pool (matching the Graph connection pool),
+# so a slow SerpApi burst can't queue them behind analysis workers
+_graph_executor = concurrent.futures.ThreadPoolExecutor(max_workers=10, thread_name_prefix="graph")
+
+# Overall time budget (seconds) for one analysis, shared by all of its workers
+ANALYSIS_TIMEOUT = 120
+
+def _future_result(future, name, fallback, deadline):
+    """Returns a worker's result, or the fallback if the worker raised or missed the deadline."""
+    try:
+        return future.result(timeout=max(0, deadline - time.monotonic()))
+    except concurrent.futures.TimeoutError:
+        logger.warning("%s Worker timed out", name)
+        return fallback
+    except Exception as e:
+        logger.error("%s Worker Failed: %s", name, e)
+        return fallback
+
+def _run_analysis(keyword, deadline, start_recommendation=None):
+    """
+    Runs the 4 SerpApi workers in parallel and collects their results.
+    If given, start_recommendation(partial_data) is called as soon as topics/queries/news are in,
+    so the Groq call overlaps a slow forecast worker; its return value is passed back as the 2nd item.
+    """
+    # Launch all 4 tasks simultaneously
+    f_trend = _executor.submit(worker_forecast, keyword)
+    f_topics = _executor.submit(worker_topics, keyword)
+    f_queries = _executor.submit(worker_queries, keyword)
+    f_news = _executor.submit(worker_news, keyword)
+
+    # Collect results. Each worker handles its own errors, but anything that
+    # still escapes only blanks that one section instead of the whole analysis.
+    trend_fallback = {"trend": "unknown", "reason": "error"}
+    related_topics = _future_result(f_topics, "Topics", [], deadline)
+    related_queries = _future_result(f_queries, "Queries", [], deadline)
+    news_items = _future_result(f_news, "News", [], deadline)
+
+    recommendation = None
+    if start_recommendation:
+        # The forecast worker may still be walking keyword variants; don't wait for it
+        partial_data = {"related_topics": related_topics, "related_queries": related_queries, "news_items": news_items}
+        if f_trend.done():
+            partial_data["trend_data"] = _future_result(f_trend, "Forecast", trend_fallback, deadline)
+        recommendation = start_recommendation(partial_data)
+
+    trend_data = _future_result(f_trend, "Forecast", trend_fallback, deadline)
+
+    analysis_results = {
+        "keyword": keyword,
+        "related_topics": related_topics,
+        "related_queries": related_queries,
+        "trend_data": trend_data,
+        "news_items": news_items
+    }
+    return analysis_results, recommendation
+
+def run_full_analysis(user_threads_token, keyword, with_recommendation=False):
     """
     Runs 4 distinct workers in parallel using 4 separate keys (if available).
+    With with_recommendation=True the Groq strategy is started as a 5th task as soon as
+    topics/queries/news are in, overlapping the LLM call with a slow forecast worker.
     """
     try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            # Launch all 4 tasks simultaneously
-            f_trend = executor.submit(worker_forecast, keyword)
-            f_topics = executor.submit(worker_topics, keyword)
-            f_queries = executor.submit(worker_queries, keyword)
-            f_news = executor.submit(worker_news, keyword)
-            
-            # Collect results (each handles its own errors, so this won't crash)
-            trend_data = f_trend.result()
-            related_topics = f_topics.result()
-            related_queries = f_queries.result()
-            news_items = f_news.result()
-
-        analysis_results = {
-            "keyword": keyword,
-            "related_topics": related_topics,
-            "related_queries": related_queries,
-            "trend_data": trend_data,
-            "news_items": news_items 
-        }
+        deadline = time.monotonic() + ANALYSIS_TIMEOUT
+        start = (lambda partial: _executor.submit(generate_groq_recommendations, partial, keyword)) \
+            if with_recommendation else None
+        analysis_results, f_groq = _run_analysis(keyword, deadline, start)
+        if f_groq:
+            analysis_results["ai_recommendation"] = _future_result(
+                f_groq, "Recommendation", "The AI recommendation timed out. Please try again.", deadline)
         return analysis_results
 
     except Exception as e:
-        print(f"An error occurred during parallel analysis: {e}")
+        logger.error("An error occurred during parallel analysis: %s", e)
         return {"error": str(e)}
 
+def _start_recommendation_stream(partial_data, keyword):
+    # Pull the first chunk right away, so Groq is already generating while the forecast finishes;
+    # later chunks wait in the socket buffer until the response reads them
+    deltas = stream_groq_recommendations(partial_data, keyword)
+    first = next(deltas, None)
+    return deltas if first is None else itertools.chain((first,), deltas)
+
+def run_streaming_analysis(user_threads_token, keyword):
+    """
+    Streaming counterpart of run_full_analysis(with_recommendation=True).
+    Returns (analysis_data, deltas): deltas yields the Groq recommendation in chunks, from a
+    stream opened as soon as topics/queries/news were in.
+    """
+    try:
+        deadline = time.monotonic() + ANALYSIS_TIMEOUT
+        return _run_analysis(keyword, deadline, lambda partial: _start_recommendation_stream(partial, keyword))
+    except Exception as e:
+        logger.error("An error occurred during parallel analysis: %s", e)
+        return {"error": str(e)}, iter(())
+
 # ==============================================================================
 # SECTION 6: THREADS API & SENTIMENT (Fully Restored)
 # ==============================================================================
 
+_GRAPH_BASE = "https://graph.threads.net/v1.0"
+_PROFILE_FIELDS = "id,username,name,threads_profile_picture_url,threads_biography"
+_THREAD_FIELDS = "id,text,permalink,timestamp,media_product_type,media_type"
+_REPLY_FIELDS = "id,text,username,timestamp"
+
+# Profile info is near-static, so account page loads reuse it for a few minutes,
+# and for a few more while a background refresh runs
+@ttl_cache(ttl=300, key=_token_cache_key, stale_ttl=600)
 def get_threads_profile(access_token):
-    url = "https://graph.threads.net/v1.0/me"
-    params = {"fields": "id,username,name,threads_profile_picture_url,threads_biography", "access_token": access_token}
+    url = f"{_GRAPH_BASE}/me"
+    params = {"fields": _PROFILE_FIELDS, "access_token": access_token}
     try:
-        return requests.get(url, params=params, timeout=15).json()
+        return orjson.loads(_session.get(url, params=params, timeout=GRAPH_TIMEOUT).content)
     except Exception:
         return {"error": "Invalid response from Threads API"}
 
+# Re-fetching the same timeline within a minute (page reloads, repeated clicks) is served from cache
+@ttl_cache(ttl=60, key=_user_threads_cache_key)
 def fetch_user_threads(access_token, limit=3, since=None, until="now"):
-    profile = get_threads_profile(access_token)
-    user_id = profile.get("id")
-    if not user_id: return {"error": "Could not fetch Threads user id", "profile": profile}
-    
-    params = {
-        "fields": "id,text,permalink,timestamp,media_product_type,media_type", 
-        "limit": limit, 
-        "access_token": access_token
-    }
+    """
+    Fetches the user's recent posts. The Graph API resolves "me" from the token,
+    so no profile lookup is needed first.
+    """
+    params = {"fields": _THREAD_FIELDS, "limit": limit, "access_token": access_token}
     if since: params["since"] = since
     if until and until != "now": params["until"] = until
     
-    url = f"https://graph.threads.net/v1.0/{user_id}/threads"
+    url = f"{_GRAPH_BASE}/me/threads"
     try:
-        r = requests.get(url, params=params, timeout=20)
-        out = r.json()
-        out["_profile"] = profile
-        return out
+        r = _session.get(url, params=params, timeout=GRAPH_TIMEOUT)
+        # orjson parses the body bytes directly, skipping the text decode r.json() does
+        out = orjson.loads(r.content)
     except Exception:
         return {"error": "Invalid response from Threads API"}
+    return out
 
 def fetch_replies(access_token, post_id, reverse=True):
-    params = {"fields": "id,text,username,timestamp", "access_token": access_token}
+    params = {"fields": _REPLY_FIELDS, "access_token": access_token}
     if reverse: params["reverse"] = "true"
-    url = f"https://graph.threads.net/v1.0/{post_id}/replies"
+    url = f"{_GRAPH_BASE}/{post_id}/replies"
     try:
-        return requests.get(url, params=params, timeout=20).json()
+        return orjson.loads(_session.get(url, params=params, timeout=GRAPH_TIMEOUT).content)
     except Exception:
         return {"error": "Invalid response from Threads API"}
 
+def fetch_threads_with_replies(access_token, limit=3, since=None, until="now"):
+    """
+    Fetches the user's posts, then the replies of every post concurrently on the Graph pool,
+    so N posts cost about one extra round trip instead of N sequential ones.
+    Each post gets a "replies" list, or a "replies_error" message if its fetch failed or
+    didn't finish within GRAPH_DEADLINE.
+    """
+    deadline = time.monotonic() + GRAPH_DEADLINE
+    threads_json = fetch_user_threads(access_token, limit=limit, since=since, until=until)
+    posts = threads_json.get("data") if "error" not in threads_json else None
+    if not posts:
+        return threads_json
+
+    timed_out = {"error": "Timed out fetching replies"}
+    if time.monotonic() >= deadline:
+        # The posts call used up the whole budget; don't queue work that would be abandoned
+        return dict(threads_json, data=[dict(post, replies_error=timed_out["error"]) for post in posts])
+
+    futures = [_graph_executor.submit(fetch_replies, access_token, post["id"]) for post in posts]
+    with_replies = []
+    for post, future in zip(posts, futures):
+        replies = _future_result(future, "Replies", timed_out, deadline)
+        if replies is timed_out:
+            future.cancel()  # no-op if already running; drops it from the queue otherwise
+        if "error" in replies:
+            with_replies.append(dict(post, replies_error=replies["error"]))
+        else:
+            with_replies.append(dict(post, replies=replies.get("data", [])))
+    return dict(threads_json, data=with_replies)
+
+# Hugging Face fallbacks, kept for reference. If re-enabled, add `from operator import itemgetter`
+# (picking the top label with itemgetter avoids a lambda call per comparison).
 # def analyze_replies_sentiment(replies_list):
 #     HF_API = os.environ.get("HF_API_KEY")
 #     if not HF_API:
@@ -440,7 +752,7 @@ def fetch_replies(access_token, post_id, reverse=True):
 #         try:
 #             res = requests.post(api_url, headers=headers, json={"inputs": text}, timeout=30).json()
 #             if isinstance(res, list) and res:
-#                 top = max(res[0], key=lambda x: x['score'])
+#                 top = max(res[0], key=itemgetter('score'))
 #                 label = top['label'].upper()
 #                 score = top['score']
 #             else:
@@ -519,7 +831,7 @@ def fetch_replies(access_token, post_id, reverse=True):
             
 #             # Parse the response (Handle [[{label: 'positive', score: 0.9}]] format)
 #             if isinstance(result, list) and len(result) > 0 and isinstance(result[0], list):
-#                 top = max(result[0], key=lambda x: x['score'])
+#                 top = max(result[0], key=itemgetter('score'))
 #                 label_raw = top['label'].lower() # Normalize to lowercase
 #                 score = float(top['score'])
 #             else:
@@ -586,12 +898,35 @@ def fetch_replies(access_token, post_id, reverse=True):
 #         "recommendations": recommendations
 #     }
 
+# VADER loads its lexicon from disk when constructed, so build one analyzer at import and share it.
+# polarity_scores only reads the lexicon, so it is safe to use from multiple threads.
+_VADER = SentimentIntensityAnalyzer()
+
+# Only the first part of a reply is scored, and links are dropped since they only add noise tokens
+_MAX_SCORED_CHARS = 1000
+_URL_RE = re.compile(r"https?://\S+")
+
+def _text_for_scoring(text):
+    return _URL_RE.sub("", text[:_MAX_SCORED_CHARS])
+
+# Replies to popular posts repeat a lot ("🔥", "W", "same"), and scoring is deterministic,
+# so repeated texts are a dict lookup instead of a full VADER pass
+@functools.lru_cache(maxsize=4096)
+def _score(text):
+    return _VADER.polarity_scores(_text_for_scoring(text))['compound']
+
+def _sentiment_label(compound_score):
+    # Label thresholds follow the VADER standard
+    return "POSITIVE" if compound_score >= 0.05 else ("NEGATIVE" if compound_score <= -0.05 else "NEUTRAL")
+
 def analyze_replies_sentiment(replies_list):
     """
     Runs sentiment analysis LOCALLY using VADER.
     This eliminates API timeouts (410/503 errors) completely.
     """
-    if not replies_list:
+    # Skip replies without text up front, so the scoring pass only sees real work
+    texts = [(reply, text) for reply in replies_list if (text := reply.get("text") or "").strip()]
+    if not texts:
         return {
             "per_reply": [],
             "cumulative_sentiment": 0.0,
@@ -599,46 +934,28 @@ def analyze_replies_sentiment(replies_list):
             "recommendations": ["No replies with text found to analyze."]
         }
 
-    # Initialize VADER analyzer (Runs locally, no API key needed)
-    analyzer = SentimentIntensityAnalyzer()
-    
-    per_reply = []
-    sentiments_vals = []
-
-    print(f"🔍 DEBUG: Analyzing {len(replies_list)} replies locally with VADER...")
+    logger.debug("Analyzing %d of %d replies locally with VADER", len(texts), len(replies_list))
 
-    for reply in replies_list:
-        text = reply.get("text", "")
-        if not text.strip(): continue
-
-        try:
-            # VADER gives a 'compound' score from -1.0 (negative) to 1.0 (positive)
-            scores = analyzer.polarity_scores(text)
-            compound_score = scores['compound']
-            
-            # Determine Label based on VADER standards
-            if compound_score >= 0.05:
-                label = "POSITIVE"
-            elif compound_score <= -0.05:
-                label = "NEGATIVE"
-            else:
-                label = "NEUTRAL"
-
-            sentiments_vals.append(compound_score)
-
-            per_reply.append({
-                "username": reply.get("username"), 
-                "text": text, 
-                "label": label, 
-                "score": float(compound_score),
-                "polarity": float(compound_score),
-                "permalink": reply.get("permalink"),
-                "timestamp": reply.get("timestamp")
-            })
-            
-        except Exception as e:
-            print(f"❌ Error: {e}") #print(f"❌ VADER Error: {e}")
-            per_reply.append({"text": text, "error": str(e)})
+    # VADER gives a 'compound' score from -1.0 (negative) to 1.0 (positive).
+    # It doesn't raise on normal input, so one try covers the whole batch.
+    try:
+        sentiments_vals = [_score(text) for _, text in texts]
+    except Exception as e:
+        logger.error("VADER Error: %s", e)
+        sentiments_vals = []
+
+    per_reply = [
+        {
+            "username": reply.get("username"),
+            "text": text,
+            "label": _sentiment_label(compound_score),
+            "score": float(compound_score),
+            "polarity": float(compound_score),
+            "permalink": reply.get("permalink"),
+            "timestamp": reply.get("timestamp")
+        }
+        for (reply, text), compound_score in zip(texts, sentiments_vals)
+    ]
 
     if not sentiments_vals:
         return {
@@ -648,7 +965,11 @@ def analyze_replies_sentiment(replies_list):
             "recommendations": ["Could not analyze sentiment."]
         }
 
-    cumulative = sum(sentiments_vals) / len(sentiments_vals)
+    cumulative = statistics.fmean(sentiments_vals)
+    # Label counts, so the UI can show the distribution without re-scanning per_reply
+    positive = sum(1 for v in sentiments_vals if v >= 0.05)
+    negative = sum(1 for v in sentiments_vals if v <= -0.05)
+    distribution = {"positive": positive, "negative": negative, "neutral": len(sentiments_vals) - positive - negative}
 
     # Generate Recommendations based on score
     if cumulative > 0.05:
@@ -674,12 +995,15 @@ def analyze_replies_sentiment(replies_list):
         "per_reply": per_reply,
         "cumulative_sentiment": cumulative,
         "overall_sentiment": overall,
+        "distribution": distribution,
         "recommendations": recommendations
     }
 
 def generate_positive_tips(replies_text):
+    client = get_groq_client()
+    if client is None:
+        return "Groq API key not configured."
     try:
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
         return client.chat.completions.create(
             messages=[
                 {'role': 'system', 'content': "You are a social media strategist."},
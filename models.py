@@ -3,6 +3,7 @@
 # It acts as the blueprint for our tables.
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -17,10 +18,21 @@ class User(UserMixin, db.Model):
     """
     # Define the table columns
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(150), unique=True, nullable=False)
+    # Indexed explicitly: every login and registration looks users up by username
+    username = db.Column(db.String(150), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(256), nullable=False)
     encrypted_threads_token = db.Column(db.String(512), nullable=True)
 
+    @staticmethod
+    def normalize_username(username):
+        """Usernames are case-insensitive: stored and looked up trimmed and lowercased."""
+        return (username or '').strip().lower()
+
+    @validates('username')
+    def _validate_username(self, key, value):
+        # Every assignment is normalised, so equality lookups hit the unique index directly
+        return self.normalize_username(value)
+
     def set_password(self, password):
         """
         Creates a secure hash from a plain-text password and stores it.
@@ -33,4 +45,15 @@ class User(UserMixin, db.Model):
         Checks if a submitted plain-text password matches the stored hash.
         Returns True if it matches, False otherwise.
         """
-        return check_password_hash(self.password_hash, password)
\ No newline at end of file
+        return check_password_hash(self.password_hash, password)
+
+
+class SessionUser(UserMixin):
+    """
+    Lightweight stand-in for User, rebuilt from the identity cached in the signed session cookie.
+    Only page routes get one (they just render templates), so serving them costs no database query.
+    """
+
+    def __init__(self, user_id, username):
+        self.id = user_id
+        self.username = username
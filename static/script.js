@@ -134,18 +134,47 @@ document.addEventListener('DOMContentLoaded', () => {
             analyzeBtn.disabled = true;
 
             try {
-                const response = await fetch('/api/analyze', {
+                const response = await fetch('/api/analyze/stream', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ keyword })
                 });
-                const data = await response.json();
-                
-                if (response.ok) {
-                    displayResults(data);
-                } else {
+
+                if (!response.ok) {
+                    const data = await response.json();
                     resultsContainer.innerHTML = `<div class="card"><p class="message error">${data.error}</p></div>`;
+                    return;
+                }
+
+                // The response is newline-delimited JSON: the analysis first, then the
+                // AI recommendation in chunks, so the strategy renders as it is generated.
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffered = '';
+                let recommendation = '';
+
+                const handleLine = (line) => {
+                    if (!line.trim()) return;
+                    const msg = JSON.parse(line);
+                    if (msg.type === 'analysis') {
+                        displayResults({ ...msg.data, ai_recommendation: '_Generating strategy..._' });
+                        loader.classList.add('hidden');
+                    } else if (msg.type === 'recommendation') {
+                        recommendation += msg.delta;
+                        const aiEl = document.getElementById('ai-recommendation');
+                        if (aiEl) aiEl.innerHTML = marked.parse(recommendation);
+                    }
+                };
+
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffered += decoder.decode(value, { stream: true });
+                    const lines = buffered.split('\n');
+                    buffered = lines.pop();
+                    lines.forEach(handleLine);
                 }
+                handleLine(buffered);
             } catch (error) {
                 resultsContainer.innerHTML = `<div class="card"><p class="message error">An unexpected error occurred.</p></div>`;
             } finally {
@@ -197,7 +226,7 @@ document.addEventListener('DOMContentLoaded', () => {
             
             <div class="card">
                 <h3>🤖 AI-Powered Strategy</h3>
-                ${aiRecommendationHtml}
+                <div id="ai-recommendation">${aiRecommendationHtml}</div>
             </div>
 
             <div class="card">
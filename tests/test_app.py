@@ -0,0 +1,68 @@
+# tests/test_app.py
+# Route-level tests using Flask's test client against an in-memory SQLite database.
+
+import os
+
+from cryptography.fernet import Fernet
+
+# The app reads its configuration at import time, so it must be in place first
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+import pytest
+
+import app as app_module
+from app import app as flask_app
+from models import db
+
+
+@pytest.fixture
+def client():
+    flask_app.config.update(TESTING=True)
+    with flask_app.app_context():
+        db.create_all()
+    # Requests push their own app context, so per-request state (flask.g) isn't shared between them
+    yield flask_app.test_client()
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def register_and_login(client, username="alice", password="secret"):
+    client.post("/api/register", json={"username": username, "password": password})
+    response = client.post("/api/login", json={"username": username, "password": password})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("endpoint", ["/api/analyze", "/api/analyze/stream"])
+def test_analyze_without_saved_token_asks_for_one(client, endpoint):
+    register_and_login(client)
+
+    response = client.post(endpoint, json={"keyword": "python"})
+
+    assert response.status_code == 400
+    assert "Threads Access Token" in response.get_json()["error"]
+
+
+def test_api_requests_leave_the_session_cookie_alone(client):
+    # A response that re-sends the session could log a user back in after they logged out
+    register_and_login(client)
+
+    response = client.get("/api/account_info")
+
+    assert response.status_code == 200
+    assert "Set-Cookie" not in response.headers
+
+
+def test_fetch_threads_without_replies_keeps_the_requested_limit(client, monkeypatch):
+    register_and_login(client)
+    client.post("/api/update_token", json={"token": "threads-token"})
+    calls = []
+    monkeypatch.setattr(app_module, "fetch_user_threads",
+                        lambda token, **kwargs: calls.append((token, kwargs)) or {"data": []})
+
+    response = client.post("/api/fetch_threads", json={"limit": 50})
+
+    assert response.status_code == 200
+    assert calls == [("threads-token", {"limit": 50, "since": None, "until": "now"})]